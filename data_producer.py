@@ -1,12 +1,60 @@
 import time
+import contextlib
 import random
+import numpy as np
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-from psycopg2.pool import SimpleConnectionPool
-from datetime import datetime
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import execute_batch
+from datetime import datetime, timedelta
+import io
 import os
+import queue
+import struct
+import threading
 from dotenv import load_dotenv
 import logging
+from logging.handlers import QueueHandler, QueueListener
+
+
+# Maximum number of rows waiting in the write queue before new rows are dropped
+WRITE_QUEUE_SIZE = 10000
+# Maximum number of rows the writer thread collects into one flush
+WRITER_BATCH_SIZE = 500
+# Queued after each power burst so the writer commits the burst as one batch
+FLUSH_MARKER = object()
+# Number of INSERT statements execute_batch joins into one round-trip
+EXECUTE_BATCH_PAGE_SIZE = 100
+# Number of rows in a batch from which COPY is used instead of INSERT.
+# A full cycle (a state change plus a 100-sample power burst) reaches it;
+# smaller batches are partial bursts, e.g. the one flushed on shutdown.
+COPY_THRESHOLD = 100
+# Seconds between two power consumption samples
+POWER_INTERVAL = 0.01
+# Connections kept open in the pool. create_table returns its connection
+# before the writer thread starts, and the writer then holds that same one
+# for its lifetime, so one is enough. It is opened up front so no caller
+# pays for connect and auth.
+POOL_SIZE = 1
+
+# Random generator used to draw samples in bulk
+rng = np.random.default_rng()
+
+# COPY binary format: signature, flags field and header extension length
+COPY_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+# COPY binary format: a field count of -1 ends the data
+COPY_BINARY_TRAILER = struct.pack(">h", -1)
+# Field count and signal_type length, followed by the signal_type bytes
+COPY_ROW_START = struct.Struct(">hi")
+# Length and float8 value, then length and timestamp in microseconds
+COPY_ROW_END = struct.Struct(">idiq")
+# PostgreSQL timestamps count from 2000-01-01
+PG_EPOCH = datetime(2000, 1, 1)
+
+# Shared connection pool, created once in __main__
+connection_pool = None
+# Background listener writing log records, started by setup_logging
+log_listener = None
 
 
 class RaiseOnErrorHandler(logging.Handler):
@@ -23,23 +71,42 @@ class RaiseOnErrorHandler(logging.Handler):
 
 
 def setup_logging():
-    """Sets up logging with a configurable log level."""
+    """
+    Sets up logging with a configurable log level.
+    Records are only queued by the logging thread; the file and console
+    writes happen on the returned QueueListener's thread.
+    """
     log_level = os.getenv("LOG_LEVEL", "INFO").upper()
 
+    formatter = logging.Formatter("[%(levelname)s] %(asctime)s %(message)s")
+    handlers = [
+        logging.FileHandler("data_producer.log"),  # Log to a file
+        logging.StreamHandler()  # Also log to the console
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, *handlers)
+    listener.start()
+
+    # Only the message is rendered before queueing; the listener's handlers
+    # add the level and time prefix
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+
     logging.basicConfig(
         level=log_level,  # Set log level dynamically
-        format="[%(levelname)s] %(asctime)s %(message)s",
-        handlers=[
-            logging.FileHandler("data_producer.log"),  # Log to a file
-            logging.StreamHandler()  # Also log to the console
-        ]
+        handlers=[queue_handler]
     )
 
+    # Kept on the root logger so errors still raise in the calling thread
     logger = logging.getLogger()
     logger.addHandler(RaiseOnErrorHandler())
 
     logging.info("Initiating ...")
     logging.info(f"Logging initialized with level: {log_level}")
+    return listener
 
 
 def get_db_configuration():
@@ -78,20 +145,29 @@ def get_db_configuration():
     except ValueError:
         raise ValueError("DB_PORT must be a valid integer")
 
+    # Optional durability trade-offs, only enabled when set to 1
+    DB_CONFIG["unlogged"] = os.getenv("DB_UNLOGGED") == "1"
+    DB_CONFIG["sync_off"] = os.getenv("DB_SYNC_OFF") == "1"
+
     return DB_CONFIG
 
 
-def setup_connection_pool():
+def setup_connection_pool(db_config):
     """Sets up a connection pool for PostgreSQL."""
+    # Don't wait for the WAL flush on commit; a crash may lose the last
+    # few transactions but never corrupts the table
+    options = "-c synchronous_commit=off" if db_config["sync_off"] else None
     try:
-        return SimpleConnectionPool(
-            minconn=1,
-            maxconn=10,
-            dbname=DB_CONFIG["dbname"],
-            user=DB_CONFIG["user"],
-            password=DB_CONFIG["password"],
-            host=DB_CONFIG["host"],
-            port=DB_CONFIG["port"]
+        # Thread-safe, since the writer thread checks out connections too
+        return ThreadedConnectionPool(
+            minconn=POOL_SIZE,
+            maxconn=POOL_SIZE,
+            dbname=db_config["dbname"],
+            user=db_config["user"],
+            password=db_config["password"],
+            host=db_config["host"],
+            port=db_config["port"],
+            options=options
         )
     except psycopg2.DatabaseError as e:
         error_message = f"Database error during connection pool setup: {e}"
@@ -99,27 +175,27 @@ def setup_connection_pool():
         raise
 
 
-def create_database():
+def create_database(db_config):
     """Creates the database if it doesn't exist"""
     try:
         conn = psycopg2.connect(
             dbname="postgres",  # need to connect to a pre-existing Database before creating one
-            user=DB_CONFIG["user"],
-            password=DB_CONFIG["password"],
-            host=DB_CONFIG["host"],
-            port=DB_CONFIG["port"])
+            user=db_config["user"],
+            password=db_config["password"],
+            host=db_config["host"],
+            port=db_config["port"])
         conn.autocommit = True
         cursor = conn.cursor()
 
         # Check if the database exists
         cursor.execute(
-            "SELECT 1 FROM pg_database WHERE datname = %s", (DB_CONFIG["dbname"],))
+            "SELECT 1 FROM pg_database WHERE datname = %s", (db_config["dbname"],))
         if not cursor.fetchone():
-            cursor.execute(f"CREATE DATABASE {DB_CONFIG['dbname']};")
+            cursor.execute(f"CREATE DATABASE {db_config['dbname']};")
             logging.info(
-                f"Database '{DB_CONFIG['dbname']}' created successfully.")
+                f"Database '{db_config['dbname']}' created successfully.")
         else:
-            logging.info(f"Database '{DB_CONFIG['dbname']}' already exists.")
+            logging.info(f"Database '{db_config['dbname']}' already exists.")
 
         cursor.close()
         conn.close()
@@ -127,16 +203,28 @@ def create_database():
         logging.error(f"Error creating database: {e}")
 
 
-def create_table(connection_pool):
-    """Creates the table schema"""
+@contextlib.contextmanager
+def pooled(connection_pool):
+    """
+    Checks a connection out of the pool and always returns it afterwards.
+    The connection is never closed here; the pool owns its lifecycle.
+    """
+    conn = connection_pool.getconn()
     try:
-        conn = connection_pool.getconn()
-        cursor = conn.cursor()
+        yield conn
+    finally:
+        connection_pool.putconn(conn)
 
-        table_name = DB_CONFIG["table_name"]
+
+def create_table(connection_pool, db_config):
+    """Creates the table schema"""
+    try:
+        table_name = db_config["table_name"]
+        # An unlogged table skips the WAL but is emptied after a crash
+        unlogged = "UNLOGGED " if db_config["unlogged"] else ""
 
         TABLE_SCHEMA = f"""
-        CREATE TABLE IF NOT EXISTS {table_name} (
+        CREATE {unlogged}TABLE IF NOT EXISTS {table_name} (
             id SERIAL PRIMARY KEY,
             signal_type VARCHAR(50) NOT NULL,
             value FLOAT NOT NULL,
@@ -144,71 +232,196 @@ def create_table(connection_pool):
         );
         """
 
-        cursor.execute(TABLE_SCHEMA)
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with pooled(connection_pool) as conn, conn.cursor() as cursor:
+            cursor.execute(TABLE_SCHEMA)
+            if db_config["unlogged"]:
+                # CREATE ... IF NOT EXISTS leaves an existing table as it is,
+                # so convert a logged one (this rewrites the table once)
+                cursor.execute(
+                    "SELECT relpersistence FROM pg_class WHERE oid = %s::regclass",
+                    (table_name,))
+                if cursor.fetchone()[0] != "u":
+                    cursor.execute(f"ALTER TABLE {table_name} SET UNLOGGED;")
+                    logging.info(f"Table {table_name} converted to UNLOGGED.")
+            conn.commit()
         logging.info(f"Table {table_name} is ready.")
     except Exception as e:
         logging.error(f"Error creating table: {e}")
-    finally:
-        if conn:
-            connection_pool.putconn(conn)
 
 
-def insert_data(connection_pool, signal_type, value):
-    """Inserts data into the database"""
+def build_statements(db_config):
+    """Builds the SQL statements used by the writer thread"""
+    table_name = db_config["table_name"]
+    return {
+        "insert": f"INSERT INTO {table_name} (signal_type, value, timestamp) VALUES (%s, %s, %s)",
+        "copy": f"COPY {table_name} (signal_type, value, timestamp) FROM STDIN WITH (FORMAT binary)",
+    }
+
+
+def insert_data(write_queue, signal_type, value, timestamp=None):
+    """
+    Queues a row to be written to the database by the writer thread.
+    The timestamp is kept as seconds since the epoch and only turned into
+    a datetime by the writer thread.
+    """
+    if timestamp is None:
+        timestamp = time.time()
     try:
-        conn = connection_pool.getconn()
-        cursor = conn.cursor()
-        table_name = DB_CONFIG["table_name"]
-        query = f"""
-        INSERT INTO {table_name} (signal_type, value, timestamp)
-        VALUES (%s, %s, %s);
-        """
-        cursor.execute(query, (signal_type, value, datetime.now()))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        write_queue.put_nowait((signal_type, value, timestamp))
+    except queue.Full:
+        logging.warning(f"Write queue is full, dropping {signal_type} row.")
+
+
+def flush_buffer(conn, statements, rows):
+    """Writes a batch of rows to the database in a single transaction"""
+    if not rows:
+        return
+    if len(rows) >= COPY_THRESHOLD:
+        flush_buffer_copy(conn, statements, rows)
+        return
+    # Small batches: the plain INSERT, sent as one ;-joined page
+    values = [(signal_type, value, datetime.fromtimestamp(timestamp))
+              for signal_type, value, timestamp in rows]
+    # One transaction per batch: committed once on success,
+    # rolled back on failure
+    with conn, conn.cursor() as cursor:
+        execute_batch(cursor, statements["insert"], values,
+                      page_size=EXECUTE_BATCH_PAGE_SIZE)
+
+
+def encode_copy_binary(rows):
+    """
+    Encodes rows in the COPY binary format: the header, then per row the
+    field count, the signal_type bytes, a float8 value and a timestamp in
+    microseconds since 2000-01-01, then the trailer.
+    The timestamp is the same local naive time the INSERT path stores.
+    """
+    buf = io.BytesIO()
+    buf.write(COPY_BINARY_HEADER)
+    encoded_types = {}
+    for signal_type, value, timestamp in rows:
+        encoded_type = encoded_types.get(signal_type)
+        if encoded_type is None:
+            encoded_type = encoded_types[signal_type] = signal_type.encode()
+        micros = (datetime.fromtimestamp(timestamp) - PG_EPOCH) // timedelta(microseconds=1)
+        buf.write(COPY_ROW_START.pack(3, len(encoded_type)))
+        buf.write(encoded_type)
+        buf.write(COPY_ROW_END.pack(8, float(value), 8, micros))
+    buf.write(COPY_BINARY_TRAILER)
+    buf.seek(0)
+    return buf
+
+
+def flush_buffer_copy(conn, statements, rows):
+    """
+    Writes a batch of rows to the database with COPY FROM STDIN.
+    Rows are sent in the COPY binary format, so values travel as raw
+    float8 and timestamp bytes and the server doesn't parse any text.
+    """
+    buf = encode_copy_binary(rows)
+    with conn, conn.cursor() as cursor:
+        cursor.copy_expert(statements["copy"], buf)
+
+
+def writer_loop(connection_pool, db_config, write_queue):
+    """Drains the write queue and writes the rows to the database in batches"""
+    statements = build_statements(db_config)
+    try:
+        with pooled(connection_pool) as conn:
+            while True:
+                # Block until there is something to write, then keep collecting
+                # rows until the end of the power burst or until the batch is full
+                row = write_queue.get()
+                if row is None:
+                    return
+                if row is FLUSH_MARKER:
+                    continue
+                rows = [row]
+                while len(rows) < WRITER_BATCH_SIZE:
+                    row = write_queue.get()
+                    if row is None:
+                        flush_buffer(conn, statements, rows)
+                        return
+                    if row is FLUSH_MARKER:
+                        break
+                    rows.append(row)
+                flush_buffer(conn, statements, rows)
     except Exception as e:
-        logging.error(f"Error inserting data: {e}")
-    finally:
-        if conn:
-            connection_pool.putconn(conn)
+        # Raises through RaiseOnErrorHandler, so a failed write stops the
+        # writer; generate_data then stops at the start of its next cycle
+        logging.error(f"Error writing data: {e}")
 
 
-def generate_data(connection_pool):
+def generate_data(connection_pool, db_config):
     """Generates data to be later insereted in the table"""
+    # Rows are handed to a background writer so that generation never
+    # waits on the database
+    write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+    writer = threading.Thread(
+        target=writer_loop, args=(connection_pool, db_config, write_queue),
+        daemon=True)
+    writer.start()
+
     while True:
         try:
+            if not writer.is_alive():
+                logging.error("Writer thread stopped unexpectedly.")
+
             # State change every 1-5 seconds
             time.sleep(random.uniform(1, 5))
-            insert_data(connection_pool, "state_change", random.choice([0, 1]))
+            insert_data(write_queue, "state_change", random.choice([0, 1]))
 
             # Error every 10-30 seconds
             if random.random() < 0.1:
                 # The error codes are between 1-100
-                insert_data(connection_pool, "error", random.randint(1, 100))
+                insert_data(write_queue, "error", random.randint(1, 100))
 
             # Power consumption every 0.01 seconds
-            for _ in range(100):  # Simulate 1-second batch
-                insert_data(connection_pool, "power",
-                            random.uniform(100.0, 500.0))
-                time.sleep(0.01)
+            # One clock read per batch, each sample is offset from it
+            batch_start = time.time()
+            power_values = rng.uniform(100.0, 500.0, size=100).tolist()
+            # Sleep until each sample's deadline rather than a fixed interval,
+            # so time spent in the loop doesn't slow the sample rate down
+            next_deadline = time.monotonic()
+            lag = 0.0
+            for i, value in enumerate(power_values):  # Simulate 1-second batch
+                insert_data(write_queue, "power", value,
+                            batch_start + i * POWER_INTERVAL)
+                next_deadline += POWER_INTERVAL
+                sleep_for = next_deadline - time.monotonic()
+                if sleep_for > 0:
+                    time.sleep(sleep_for)
+                else:
+                    lag = max(lag, -sleep_for)
+            if lag > 0:
+                logging.warning(
+                    f"Power batch fell behind schedule by up to {lag:.3f} seconds.")
+
+            # End of the burst: the writer commits it in one transaction.
+            # A full queue already makes the writer flush full batches.
+            try:
+                write_queue.put_nowait(FLUSH_MARKER)
+            except queue.Full:
+                pass
         except KeyboardInterrupt:
             logging.warning("Data generation stopped.")
             break
 
+    # Let the writer flush whatever is still queued before shutting down
+    if writer.is_alive():
+        write_queue.put(None)
+        writer.join()
+
 
 if __name__ == "__main__":
     try:
-        setup_logging()
+        log_listener = setup_logging()
         DB_CONFIG = get_db_configuration()
 
-        create_database()
-        connection_pool = setup_connection_pool()
-        create_table(connection_pool)
-        generate_data(connection_pool)
+        create_database(DB_CONFIG)
+        connection_pool = setup_connection_pool(DB_CONFIG)
+        create_table(connection_pool, DB_CONFIG)
+        generate_data(connection_pool, DB_CONFIG)
 
     except Exception as e:
         logging.critical(f"Unexpected error occurred: {e}")
@@ -217,3 +430,5 @@ if __name__ == "__main__":
             connection_pool.closeall()
             logging.info("Connection pool closed.")
             logging.info("Completed executing.")
+        if log_listener:
+            log_listener.stop()